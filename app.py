@@ -1,12 +1,9 @@
 import streamlit as st
-import base64
 from pathlib import Path
 import os
 from dotenv import load_dotenv
-from process import run_agent_analysis
-import pandas as pd
-from io import BytesIO
 import time
+import asyncio
 
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
@@ -26,26 +23,28 @@ def stylable_container(key, css_styles):
     """, unsafe_allow_html=True)
     return st.container()
 
-def add_bg_from_local(image_file):
-    with Path(image_file).open("rb") as file:
-        encoded_string = base64.b64encode(file.read()).decode()
-    st.markdown(
-        f"""
+@st.cache_resource
+def _bg_style(image_file):
+    return f"""
         <style>
         .stApp {{
-            background-image: url(data:image/png;base64,{encoded_string});
+            background-image: url('app/static/{image_file}');
             background-size: cover;
             background-position: center;
             background-repeat: no-repeat;
         }}
         </style>
-        """,
-        unsafe_allow_html=True
-    )
+        """
+
+def add_bg_from_local(image_file):
+    st.markdown(_bg_style(image_file), unsafe_allow_html=True)
+
+@st.cache_resource
+def _css(css_file):
+    return f"<style>{Path(css_file).read_text()}</style>"
 
 def load_css(css_file):
-    with open(css_file, "r") as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+    st.markdown(_css(css_file), unsafe_allow_html=True)
 
 def get_button_style(button_class):
     if button_class == "current":
@@ -55,6 +54,20 @@ def get_button_style(button_class):
     else:
         return "background-color: #4B484340; color: #333333; font-size: 18px;"
 
+@st.cache_data
+def _nav_style(current_page, page_count):
+    css = "\n".join(
+        f"""
+            div.row-widget.stButton > button[key="nav_{i}"] {{
+                {get_button_style("current" if i == current_page else "previous" if i == current_page - 1 else "")}
+            }}"""
+        for i in range(page_count)
+    )
+    return f"<style>{css}\n</style>"
+
+def go_to_page(page_index):
+    st.session_state.current_page = page_index
+
 def setup_navigation():
     st.sidebar.markdown("<h1 style='text-align: center; color: #AC8D61;'>Navegação</h1>", unsafe_allow_html=True)
     
@@ -64,19 +77,10 @@ def setup_navigation():
         st.session_state.current_page = 0
 
     for i, page in enumerate(pages):
-        button_class = "current" if i == st.session_state.current_page else "previous" if i == st.session_state.current_page - 1 else ""
+        st.sidebar.button(page, key=f"nav_{i}", use_container_width=True, disabled=(i == st.session_state.current_page),
+                          on_click=go_to_page, args=(i,))
 
-        if st.sidebar.button(page, key=f"nav_{i}", use_container_width=True, disabled=(i == st.session_state.current_page)):
-            st.session_state.current_page = i
-            st.rerun()
-
-        st.markdown(f"""
-            <style>
-            div.row-widget.stButton > button[key="nav_{i}"] {{
-                {get_button_style(button_class)}
-            }}
-            </style>
-            """, unsafe_allow_html=True)
+    st.markdown(_nav_style(st.session_state.current_page, len(pages)), unsafe_allow_html=True)
 
     return pages
 
@@ -90,16 +94,69 @@ def remove_direcionador(direcionador_to_remove):
     if direcionador_to_remove in st.session_state.direcionadores:
         st.session_state.direcionadores.remove(direcionador_to_remove)
 
-def convert_df_to_excel(df):
+def _excel_cell(value):
+    if value is None or value != value:
+        return None
+    if isinstance(value, (list, dict)):
+        return str(value)
+    return value
+
+def convert_records_to_excel(records):
+    from io import BytesIO
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    widths = {}
+    for record in records:
+        for column, value in record.items():
+            value = _excel_cell(value)
+            width = 0 if value is None else len(str(value))
+            if width > widths.get(column, 0):
+                widths[column] = width
+            else:
+                widths.setdefault(column, 0)
+    columns = list(widths)
+
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Oportunidade de melhorias', index=False)
-        for column in df:
-            column_width = max(df[column].astype(str).map(len).max(), len(column))
-            col_idx = df.columns.get_loc(column)
-            writer.sheets['Oportunidade de melhorias'].column_dimensions[chr(65 + col_idx)].width = column_width + 2
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Oportunidade de melhorias')
+    for col_idx, column in enumerate(columns):
+        ws.column_dimensions[get_column_letter(col_idx + 1)].width = max(widths[column], len(column)) + 2
+    ws.append(columns)
+    for record in records:
+        ws.append([_excel_cell(record.get(column)) for column in columns])
+    wb.save(output)
     return output.getvalue()
 
+@st.cache_data(show_spinner=False, max_entries=8, ttl=3600)
+def _excel_file(records):
+    return convert_records_to_excel(records)
+
+def render_excel_download(generate_label, download_label, file_name, key):
+    if not st.session_state.get('show_download_button'):
+        if st.button(generate_label, key=key):
+            st.session_state.excel_file = _excel_file(st.session_state.resultados_dict)
+            st.session_state.show_download_button = True
+
+    if st.session_state.get('show_download_button'):
+        st.download_button(
+            label=download_label,
+            data=st.session_state.excel_file,
+            file_name=file_name,
+            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def _cached_run(processo):
+    import pandas as pd
+    from process import run_agent_analysis
+
+    resultado = run_agent_analysis(processo)
+    if not isinstance(resultado, pd.DataFrame):
+        # Raising keeps failed analyses out of the cache
+        raise ValueError(f"Falha na análise do processo: {resultado}")
+    return resultado
+
 def render_diagnostico():
     if 'form_inputs' not in st.session_state:
         st.session_state.form_inputs = {
@@ -180,131 +237,130 @@ def render_diagnostico():
 
             if ramo_empresa and st.session_state.direcionadores and nome_processo and atividade and evento and causa:
                 with st.spinner('Oportunidade de melhorias em andamento...'):
+                    import pandas as pd
+                    from process import run_agent_analysis_async
+
                     start_time = time.time()
                     new_resultados = []
                     
                     if type(st.session_state.direcionadores) == str:
-                        direcao = st.session_state.direcionadores
-                        processo = f"""ramo_empresa: {ramo_empresa}, direcionadores: {direcao}, nome_do_processo: {nome_processo}, atividade: {atividade}, evento: {evento}, causa: {causa}"""
-                        analyst = run_agent_analysis(processo)
+                        direcoes = [st.session_state.direcionadores]
+                    else:
+                        direcoes = list(st.session_state.direcionadores)
+
+                    processos = [
+                        f"""ramo_empresa: {ramo_empresa}, direcionadores: {direcao}, nome_do_processo: {nome_processo}, atividade: {atividade}, evento: {evento}, causa: {causa}"""
+                        for direcao in direcoes
+                    ]
+                    analysts = asyncio.run(
+                        run_agent_analysis_async(processos, analyze=_cached_run, return_exceptions=True)
+                    )
+                    for direcao, analyst in zip(direcoes, analysts):
+                        if isinstance(analyst, Exception):
+                            st.error(f"Não foi possível obter as oportunidades de melhoria para o direcionador '{direcao}'.")
+                            continue
                         analyst['Direcionador'] = direcao
                         new_resultados.append(analyst)
-                    else:
-                        for direcao in st.session_state.direcionadores:
-                            processo = f"""ramo_empresa: {ramo_empresa}, direcionadores: {direcao}, nome_do_processo: {nome_processo}, atividade: {atividade}, evento: {evento}, causa: {causa}"""
-                            analyst = run_agent_analysis(processo)
-                            analyst['Direcionador'] = direcao
-                            new_resultados.append(analyst)
                     
                     if new_resultados:
                         st.session_state.all_resultados.extend(new_resultados)
                         resultados = pd.concat(st.session_state.all_resultados, ignore_index=True)
                         execution_time = time.time() - start_time
                         
-                        st.success(f"Oportunidade de melhorias obtidas para {len(st.session_state.direcionadores)} direcionadores em {execution_time:.2f} segundos.")
+                        st.success(f"Oportunidade de melhorias obtidas para {len(new_resultados)} direcionadores em {execution_time:.2f} segundos.")
                         
-                        st.session_state.resultados = resultados
-                        st.session_state.excel_file = convert_df_to_excel(resultados)
-                        st.session_state.show_download_button = True
+                        st.session_state.resultados_dict = resultados.to_dict('records')
+                        st.session_state.show_download_button = False
             else:
                 st.warning("Por favor, preencha todos os campos e adicione pelo menos um direcionador.")
 
-    if hasattr(st.session_state, 'show_download_button') and st.session_state.show_download_button:
-        st.download_button(
-            label="📥Baixar Excel",
-            data=st.session_state.excel_file,
-            file_name='oportunidade_melhoria.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    if 'resultados_dict' in st.session_state:
+        render_excel_download(
+            "Gerar Excel",
+            "📥Baixar Excel",
+            'oportunidade_melhoria.xlsx',
+            key="generate_diagnostico_excel_button"
         )
 
 
 
 
+@st.fragment
+def _edit_opportunity(idx, row):
+    with st.form(key=f'opportunity_form_{idx}'):
+        st.write(f"### Oportunidade {idx + 1} - Direcionador: {row.get('Direcionador', 'N/A')}")
+        
+        oportunidade_de_melhoria = st.text_area(
+            "Oportunidade de Melhoria", 
+            value=row['Oportunidade de Melhoria'], 
+            height=100
+        )
+        solucao = st.text_area(
+            "Solução", 
+            value=row['Solução'], 
+            height=100
+        )
+        backlog_de_atividades = st.text_area(
+            "Backlog de Atividades", 
+            value=row.get('Backlog de Atividades', ''), 
+            height=100
+        )
+        investimento = st.text_area(
+            "Investimento", 
+            value=row.get('Investimento', ''), 
+            height=100
+        )
+        ganhos = st.text_area(
+            "Ganhos", 
+            value=row.get('Ganhos', ''), 
+            height=100
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            save_button = st.form_submit_button(label=f"Salvar Edição para Oportunidade {idx + 1}")
+        with col2:
+            delete_button = st.form_submit_button(label=f"Excluir Oportunidade {idx + 1}", type="secondary")
+
+    if save_button:
+        row.update({
+            'Oportunidade de Melhoria': oportunidade_de_melhoria,
+            'Solução': solucao,
+            'Backlog de Atividades': backlog_de_atividades,
+            'Investimento': investimento,
+            'Ganhos': ganhos
+        })
+        st.toast(f"Edição salva para Oportunidade {idx + 1}")
+        # The download button lives outside this fragment, so a full rerun is
+        # needed to hide it once its file no longer matches the edits
+        if st.session_state.get('show_download_button'):
+            st.session_state.show_download_button = False
+            st.rerun()
+
+    if delete_button:
+        st.session_state.resultados_dict = [
+            other for other in st.session_state.resultados_dict if other is not row
+        ]
+        st.session_state.show_download_button = False
+        st.toast(f"Oportunidade {idx + 1} excluída.")
+        st.rerun()
+
 def render_planilha_final():
-    if 'resultados' not in st.session_state:
+    if 'resultados_dict' not in st.session_state:
         st.warning("Não foi executado a obtenção das Oportunidade de melhorias.")
         return
     
-    resultados = st.session_state.resultados
-    st.session_state.resultados_dict = resultados.to_dict('records')
-
     st.write("## Planilha Final")
-    changes_made = False
-    deleted_indices = set()
 
     for idx, row in enumerate(st.session_state.resultados_dict):
-        if idx in deleted_indices:  # Skip opportunities already marked for deletion
-            continue
-        
-        with st.form(key=f'opportunity_form_{idx}'):
-            st.write(f"### Oportunidade {idx + 1} - Direcionador: {row.get('Direcionador', 'N/A')}")
-            
-            oportunidade_de_melhoria = st.text_area(
-                "Oportunidade de Melhoria", 
-                value=row['Oportunidade de Melhoria'], 
-                height=100
-            )
-            solucao = st.text_area(
-                "Solução", 
-                value=row['Solução'], 
-                height=100
-            )
-            backlog_de_atividades = st.text_area(
-                "Backlog de Atividades", 
-                value=row.get('Backlog de Atividades', ''), 
-                height=100
-            )
-            investimento = st.text_area(
-                "Investimento", 
-                value=row.get('Investimento', ''), 
-                height=100
-            )
-            ganhos = st.text_area(
-                "Ganhos", 
-                value=row.get('Ganhos', ''), 
-                height=100
-            )
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                save_button = st.form_submit_button(label=f"Salvar Edição para Oportunidade {idx + 1}")
-            with col2:
-                delete_button = st.form_submit_button(label=f"Excluir Oportunidade {idx + 1}", type="secondary")
-            
-            if save_button:
-                row.update({
-                    'Oportunidade de Melhoria': oportunidade_de_melhoria,
-                    'Solução': solucao,
-                    'Backlog de Atividades': backlog_de_atividades,
-                    'Investimento': investimento,
-                    'Ganhos': ganhos
-                })
-                changes_made = True
-                st.success(f"Edição salva para Oportunidade {idx + 1}")
-            
-            if delete_button:
-                deleted_indices.add(idx)
-                st.warning(f"Oportunidade {idx + 1} marcada para exclusão.")
-
-    if deleted_indices:
-        st.session_state.resultados_dict = [
-            row for idx, row in enumerate(st.session_state.resultados_dict) if idx not in deleted_indices
-        ]
-        changes_made = True
-
-    if changes_made:
-        edited_df = pd.DataFrame(st.session_state.resultados_dict)
-        st.session_state.resultados = edited_df
-        st.session_state.excel_file = convert_df_to_excel(edited_df)
-        st.session_state.show_download_button = True
+        _edit_opportunity(idx, row)
 
-    if hasattr(st.session_state, 'show_download_button') and st.session_state.show_download_button:
-        st.download_button(
-            label="📥 Baixar Excel com Todas as Edições",
-            data=st.session_state.excel_file,
-            file_name='Oportunidade_de_melhorias_final.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+    render_excel_download(
+        "Gerar Excel com Todas as Edições",
+        "📥 Baixar Excel com Todas as Edições",
+        'Oportunidade_de_melhorias_final.xlsx',
+        key="generate_excel_button"
+    )
 
 
 def main():
@@ -333,14 +389,10 @@ def main():
     col1, col2, col3 = st.columns(3)
     with col1:
         if st.session_state.current_page > 0:
-            if st.button("Anterior", key="prev_button"):
-                st.session_state.current_page -= 1
-                st.rerun()
+            st.button("Anterior", key="prev_button", on_click=go_to_page, args=(st.session_state.current_page - 1,))
     with col3:
         if st.session_state.current_page < len(pages) - 1:
-            if st.button("Próximo", key="next_button"):
-                st.session_state.current_page += 1
-                st.rerun()
+            st.button("Próximo", key="next_button", on_click=go_to_page, args=(st.session_state.current_page + 1,))
         elif st.session_state.current_page == len(pages) - 1:
             if st.button("Finalizar", key="finish_button"):
                 st.success("Processo finalizado com sucesso!")
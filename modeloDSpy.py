@@ -76,8 +76,8 @@ class OportuneRAGClient:
             # Check if params are properly set
             if self.params4o is None:
                 raise ValueError("DSpy parameters not properly initialized")
-            dspy.settings.configure(**self.params4o)
-            resposta = self.modelo(question=prompt)
+            with dspy.context(**self.params4o):
+                resposta = self.modelo(question=prompt)
             return resposta.answer
         except Exception as e:
             print(f"ERRO AO RODAR O MODELO: {e}")
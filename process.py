@@ -1,6 +1,12 @@
+import asyncio
+import threading
 from modeloDSpy import OportuneRAGClient
 from transform_input_to_df import transform_input_to_df
 
+# O PythonREPLTool usado por transform_input_to_df troca o sys.stdout do
+# processo enquanto executa código; apenas uma transformação pode rodar por vez
+_transform_lock = threading.Lock()
+
 def run_agent_analysis(prompt):
     """
     Executa a análise utilizando os agentes OportuneRAGClient e transform_input_to_df.
@@ -13,6 +19,32 @@ def run_agent_analysis(prompt):
     """
     client = OportuneRAGClient()
     answer = client.run_model(prompt)
-    df = transform_input_to_df(answer)
     client.close_weaviate_client()
-    return df
\ No newline at end of file
+    with _transform_lock:
+        df = transform_input_to_df(answer)
+    return df
+
+async def run_agent_analysis_async(prompts, max_concurrency=4, analyze=run_agent_analysis, return_exceptions=False):
+    """
+    Executa run_agent_analysis para vários prompts de forma concorrente.
+    
+    As consultas ao OportuneRAGClient rodam em paralelo; a etapa de
+    transform_input_to_df é serializada por _transform_lock.
+    
+    Parâmetros:
+    prompts (list[str]): Prompts a serem analisados, um por direcionador.
+    max_concurrency (int): Número máximo de análises simultâneas.
+    analyze (callable): Função que executa a análise de um único prompt.
+    return_exceptions (bool): Se True, falhas são retornadas no lugar do resultado
+        em vez de interromper as demais análises.
+    
+    Retorna:
+    list[pandas.DataFrame]: Resultados na mesma ordem dos prompts.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(prompt):
+        async with semaphore:
+            return await asyncio.to_thread(analyze, prompt)
+
+    return await asyncio.gather(*(_run(prompt) for prompt in prompts), return_exceptions=return_exceptions)